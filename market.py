@@ -1,16 +1,81 @@
+import asyncio
 import datetime
+import functools
 import logging.config
 from environs import Env
 from seller import download_stock
 
+import httpx
+import msgspec
+import orjson
 import requests
 
-from seller import divide, price_conversion
+from seller import (
+    close_client,
+    get_client,
+    price_series_conversion,
+    retry_async,
+    stock_conversion,
+    upload_in_chunks,
+)
 
 logger = logging.getLogger(__file__)
 
+# Общий лимит запросов к API Яндекс Маркета для всех компаний,
+# FBS и DBS обновляются одновременно:
+_SEMAPHORE = asyncio.Semaphore(16)
 
-def get_product_list(page, campaign_id, access_token):
+
+@functools.lru_cache(maxsize=8)
+def _auth_headers(access_token):
+    """Собирает заголовок авторизации Яндекс Маркета один раз для токена.
+
+    Args:
+        access_token: Токен для авторизации в API.
+
+    Returns:
+        Словарь заголовков. Общий для всех запросов, изменять его нельзя.
+    """
+
+    return {"Authorization": f"Bearer {access_token}"}
+
+
+class Offer(msgspec.Struct, rename="camel"):
+    """Товар из ответа offer-mapping-entries, нужен только артикул."""
+
+    shop_sku: str | None = None
+
+
+class OfferMappingEntry(msgspec.Struct):
+    """Запись offer-mapping-entries, из нее берется только товар."""
+
+    offer: Offer
+
+
+class Paging(msgspec.Struct, rename="camel"):
+    """Данные пагинации, токен следующей страницы."""
+
+    next_page_token: str | None = None
+
+
+class OfferMappingEntries(msgspec.Struct, rename="camel"):
+    """Страница списка товаров Яндекс Маркета."""
+
+    offer_mapping_entries: list[OfferMappingEntry]
+    paging: Paging
+
+
+class OfferMappingEntriesResponse(msgspec.Struct):
+    """Ответ API offer-mapping-entries."""
+
+    result: OfferMappingEntries
+
+
+_PRODUCT_LIST_DECODER = msgspec.json.Decoder(OfferMappingEntriesResponse)
+
+
+@retry_async()
+async def get_product_list(page, campaign_id, access_token):
     """Получает список товаров Яндекс Маркета по id компании.
 
     Args:
@@ -19,31 +84,29 @@ def get_product_list(page, campaign_id, access_token):
         access_token: Токен для авторизации в API.
 
     Returns:
-        Словарь со списком товаров
+        Страница товаров OfferMappingEntries. Поля ответа, которые не
+        используются, при разборе JSON пропускаются.
 
     Raises:
-        requests.exceptions.HTTPError:
+        httpx.HTTPStatusError:
+        msgspec.ValidationError: Если ответ не совпадает с ожидаемой схемой.
     """
 
     endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = _auth_headers(access_token)
     payload = {
         "page_token": page,
         "limit": 200,
     }
     url = endpoint_url + f"campaigns/{campaign_id}/offer-mapping-entries"
-    response = requests.get(url, headers=headers, params=payload)
+    async with _SEMAPHORE:
+        response = await get_client().get(url, headers=headers, params=payload)
     response.raise_for_status()
-    response_object = response.json()
-    return response_object.get("result")
+    return _PRODUCT_LIST_DECODER.decode(response.content).result
 
 
-def update_stocks(stocks, campaign_id, access_token):
+@retry_async()
+async def update_stocks(stocks, campaign_id, access_token):
     """Обновляет остатки на Яндекс Маркете.
 
     Args:
@@ -55,25 +118,23 @@ def update_stocks(stocks, campaign_id, access_token):
         Обновит остатки на Яндекс Маркете и выведет ответ от API
 
     Raises:
-        requests.exceptions.HTTPError:
+        httpx.HTTPStatusError:
     """
 
     endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = _auth_headers(access_token)
     payload = {"skus": stocks}
     url = endpoint_url + f"campaigns/{campaign_id}/offers/stocks"
-    response = requests.put(url, headers=headers, json=payload)
+    response = await get_client().put(
+        url, headers=headers, content=orjson.dumps(payload)
+    )
     response.raise_for_status()
-    response_object = response.json()
+    response_object = orjson.loads(response.content)
     return response_object
 
 
-def update_price(prices, campaign_id, access_token):
+@retry_async()
+async def update_price(prices, campaign_id, access_token):
     """Обновляет цены на Яндекс Маркете.
 
         Args:
@@ -85,25 +146,22 @@ def update_price(prices, campaign_id, access_token):
             Обновит цены на Яндекс Маркете и выведет ответ от API
 
         Raises:
-            requests.exceptions.HTTPError:
+            httpx.HTTPStatusError:
     """
 
     endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = _auth_headers(access_token)
     payload = {"offers": prices}
     url = endpoint_url + f"campaigns/{campaign_id}/offer-prices/updates"
-    response = requests.post(url, headers=headers, json=payload)
+    response = await get_client().post(
+        url, headers=headers, content=orjson.dumps(payload)
+    )
     response.raise_for_status()
-    response_object = response.json()
+    response_object = orjson.loads(response.content)
     return response_object
 
 
-def get_offer_ids(campaign_id, market_token):
+async def get_offer_ids(campaign_id, market_token):
     """Получает список артикулов товаров из Яндекс Маркета.
 
         Args:
@@ -114,20 +172,26 @@ def get_offer_ids(campaign_id, market_token):
             Возвращает список артикулов товаров(SKU)
 
         Raises:
-            requests.exceptions.HTTPError:
+            httpx.HTTPStatusError:
     """
 
-    page = ""
     product_list = []
-    while True:
-        some_prod = get_product_list(page, campaign_id, market_token)
-        product_list.extend(some_prod.get("offerMappingEntries"))
-        page = some_prod.get("paging").get("nextPageToken")
-        if not page:
-            break
+    next_page = asyncio.create_task(get_product_list("", campaign_id, market_token))
+    while next_page:
+        some_prod = await next_page
+        page = some_prod.paging.next_page_token
+        # Следующая страница грузится, пока разбираем текущую:
+        next_page = None
+        if page:
+            next_page = asyncio.create_task(
+                get_product_list(page, campaign_id, market_token)
+            )
+        product_list.extend(some_prod.offer_mapping_entries)
     offer_ids = []
     for product in product_list:
-        offer_ids.append(product.get("offer").get("shopSku"))
+        # Позиции без shopSku пропускаем, а не роняем всю страницу:
+        if product.offer.shop_sku is not None:
+            offer_ids.append(product.offer.shop_sku)
     return offer_ids
 
 
@@ -135,8 +199,8 @@ def create_stocks(watch_remnants, offer_ids, warehouse_id):
     """Создает список остатков товара для загрузки в Яндекс Маркет.
 
         Args:
-            watch_remnants: Список с остатками товара.
-            offer_ids: Список артикулов товара.
+            watch_remnants: Таблица с остатками товара.
+            offer_ids: Множество артикулов товара.
             warehouse_id: id склада.
 
         Returns:
@@ -146,55 +210,39 @@ def create_stocks(watch_remnants, offer_ids, warehouse_id):
             requests.exceptions.HTTPError:
     """
 
-    stocks = list()
+    remaining = set(offer_ids)
     date = str(datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z")
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append(
-                {
-                    "sku": str(watch.get("Код")),
-                    "warehouseId": warehouse_id,
-                    "items": [
-                        {
-                            "count": stock,
-                            "type": "FIT",
-                            "updatedAt": date,
-                        }
-                    ],
-                }
-            )
-            offer_ids.remove(str(watch.get("Код")))
+    codes = watch_remnants["Код"]
+    matched = codes.isin(remaining) & ~codes.duplicated()
+    matched_codes = codes[matched]
+    counts = stock_conversion(watch_remnants.loc[matched, "Количество"]).tolist()
+    remaining.difference_update(matched_codes)
+    matched_stocks = [
+        {
+            "sku": sku,
+            "warehouseId": warehouse_id,
+            "items": [{"count": count, "type": "FIT", "updatedAt": date}],
+        }
+        for sku, count in zip(matched_codes, counts)
+    ]
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
-        stocks.append(
-            {
-                "sku": offer_id,
-                "warehouseId": warehouse_id,
-                "items": [
-                    {
-                        "count": 0,
-                        "type": "FIT",
-                        "updatedAt": date,
-                    }
-                ],
-            }
-        )
-    return stocks
+    missing_stocks = [
+        {
+            "sku": offer_id,
+            "warehouseId": warehouse_id,
+            "items": [{"count": 0, "type": "FIT", "updatedAt": date}],
+        }
+        for offer_id in remaining
+    ]
+    return matched_stocks + missing_stocks
 
 
 def create_prices(watch_remnants, offer_ids):
     """Создает список цен товара для загрузки в Яндекс Маркет.
 
     Args:
-        watch_remnants: Список с остатками товара.
-        offer_ids: Список артикулов товара.
+        watch_remnants: Таблица с остатками товара.
+        offer_ids: Множество артикулов товара.
 
     Returns:
         Список с информацией о ценах товара.
@@ -203,75 +251,109 @@ def create_prices(watch_remnants, offer_ids):
         requests.exceptions.HTTPError:
     """
 
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "id": str(watch.get("Код")),
-                # "feed": {"id": 0},
-                "price": {
-                    "value": int(price_conversion(watch.get("Цена"))),
-                    # "discountBase": 0,
-                    "currencyId": "RUR",
-                    # "vat": 0,
-                },
-                # "marketSku": 0,
-                # "shopSku": "string",
-            }
-            prices.append(price)
+    codes = watch_remnants["Код"]
+    matched = codes.isin(offer_ids)
+    values = price_series_conversion(watch_remnants.loc[matched, "Цена"]).astype(int)
+    prices = [
+        {
+            "id": offer_id,
+            # "feed": {"id": 0},
+            "price": {
+                "value": value,
+                # "discountBase": 0,
+                "currencyId": "RUR",
+                # "vat": 0,
+            },
+            # "marketSku": 0,
+            # "shopSku": "string",
+        }
+        for offer_id, value in zip(codes[matched], values.tolist())
+    ]
     return prices
 
 
-async def upload_prices(watch_remnants, campaign_id, market_token):
+async def upload_prices(watch_remnants, campaign_id, market_token, offer_ids=None):
     """Загружает цены товара в Яндекс Маркет.
 
     Args:
-        watch_remnants: Список с остатками товара.
+        watch_remnants: Таблица с остатками товара.
         campaign_id: id компании на Яндекс Маркете.
         market_token: Токен для авторизации в API.
+        offer_ids: Уже полученные артикулы товара. Если не переданы,
+            будут запрошены через get_offer_ids.
 
     Returns:
         Список с информацией о ценах товара.
 
     Raises:
-        requests.exceptions.HTTPError:
+        httpx.HTTPError:
     """
 
-    offer_ids = get_offer_ids(campaign_id, market_token)
+    if offer_ids is None:
+        offer_ids = set(await get_offer_ids(campaign_id, market_token))
     prices = create_prices(watch_remnants, offer_ids)
-    for some_prices in list(divide(prices, 500)):
-        update_price(some_prices, campaign_id, market_token)
+    await upload_in_chunks(
+        update_price, prices, 500, campaign_id, market_token, semaphore=_SEMAPHORE
+    )
     return prices
 
 
-async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id):
+async def upload_stocks(
+    watch_remnants, campaign_id, market_token, warehouse_id, offer_ids=None
+):
     """Загружает остатки товара в Яндекс Маркет.
 
         Args:
-            watch_remnants: Список с остатками товара.
+            watch_remnants: Таблица с остатками товара.
             campaign_id: id компании на Яндекс Маркете.
             market_token: Токен для авторизации в API.
             warehouse_id: id склада.
+            offer_ids: Уже полученные артикулы товара. Если не переданы,
+                будут запрошены через get_offer_ids.
 
         Returns:
             Список с остатками товаров, где количество больше нуля.
             Список всех остатков товаров.
 
         Raises:
-            requests.exceptions.HTTPError:
+            httpx.HTTPError:
         """
 
-    offer_ids = get_offer_ids(campaign_id, market_token)
+    if offer_ids is None:
+        offer_ids = set(await get_offer_ids(campaign_id, market_token))
     stocks = create_stocks(watch_remnants, offer_ids, warehouse_id)
-    for some_stock in list(divide(stocks, 2000)):
-        update_stocks(some_stock, campaign_id, market_token)
+    await upload_in_chunks(
+        update_stocks, stocks, 2000, campaign_id, market_token, semaphore=_SEMAPHORE
+    )
     not_empty = list(
         filter(lambda stock: (stock.get("items")[0].get("count") != 0), stocks)
     )
     return not_empty, stocks
 
 
-def main():
+async def _do_campaign(watch_remnants, campaign_id, market_token, warehouse_id):
+    """Обновляет остатки и цены одной компании на Яндекс Маркете.
+
+    Args:
+        watch_remnants: Таблица с остатками товара.
+        campaign_id: id компании на Яндекс Маркете.
+        market_token: Токен для авторизации в API.
+        warehouse_id: id склада.
+
+    Raises:
+        httpx.HTTPError:
+    """
+
+    offer_ids = set(await get_offer_ids(campaign_id, market_token))
+    # Обновить остатки
+    await upload_stocks(
+        watch_remnants, campaign_id, market_token, warehouse_id, offer_ids
+    )
+    # Поменять цены
+    await upload_prices(watch_remnants, campaign_id, market_token, offer_ids)
+
+
+async def main():
     """Основная функция для загрузки остатков и цен в Яндекс Маркет.
 
         Raises:
@@ -288,30 +370,36 @@ def main():
 
     watch_remnants = download_stock()
     try:
-        # FBS
-        offer_ids = get_offer_ids(campaign_fbs_id, market_token)
-        # Обновить остатки FBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_fbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_fbs_id, market_token)
-        # Поменять цены FBS
-        upload_prices(watch_remnants, campaign_fbs_id, market_token)
-
-        # DBS
-        offer_ids = get_offer_ids(campaign_dbs_id, market_token)
-        # Обновить остатки DBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_dbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_dbs_id, market_token)
-        # Поменять цены DBS
-        upload_prices(watch_remnants, campaign_dbs_id, market_token)
-    except requests.exceptions.ReadTimeout:
+        # Компании независимы: ошибка одной не должна прерывать другую,
+        # а клиент закрывается только после завершения обеих.
+        results = await asyncio.gather(
+            _do_campaign(
+                watch_remnants, campaign_fbs_id, market_token, warehouse_fbs_id
+            ),
+            _do_campaign(
+                watch_remnants, campaign_dbs_id, market_token, warehouse_dbs_id
+            ),
+            return_exceptions=True,
+        )
+        campaigns = (campaign_fbs_id, campaign_dbs_id)
+        errors = [
+            (campaign_id, result)
+            for campaign_id, result in zip(campaigns, results)
+            if isinstance(result, Exception)
+        ]
+        for campaign_id, error in errors:
+            logger.error("Не удалось обновить компанию %s: %s", campaign_id, error)
+        if errors:
+            raise errors[0][1]
+    except (requests.exceptions.ReadTimeout, httpx.TimeoutException):
         print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
+    except (requests.exceptions.ConnectionError, httpx.NetworkError) as error:
         print(error, "Ошибка соединения")
     except Exception as error:
         print(error, "ERROR_2")
+    finally:
+        await close_client()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,17 +1,174 @@
+import asyncio
+import functools
 import io
 import logging.config
 import os
+import pickle
 import re
+import tempfile
 import zipfile
+from itertools import islice
+from pathlib import Path
 from environs import Env
 
+import httpx
+import msgspec
+import numpy as np
+import orjson
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__file__)
 
+TIMEOUT = (3.05, 30)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_ATTEMPTS = 8
+RETRY_BACKOFF = 0.5
+UPLOAD_CONCURRENCY = 8
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+CACHE_DIR = Path.home() / ".cache" / "seller-apis"
+_NONDIGIT = re.compile(r"[^0-9]")
+JSON_HEADERS = {
+    "Content-Type": "application/json",
+    "Accept": "application/json",
+    "Accept-Encoding": "gzip, deflate",
+}
+
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=RETRY_ATTEMPTS,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(["GET", "POST", "PUT"]),
+            respect_retry_after_header=True,
+        ),
+    ),
+)
+
+_CLIENT = None
+_SEMAPHORE = asyncio.Semaphore(64)
+
+
+def get_client():
+    """Возвращает общий HTTP/2 клиент httpx, создавая его при первом вызове.
+
+    Параллельные запросы к одному API мультиплексируются в одно TLS-соединение.
 
-def get_product_list(last_id, client_id, seller_token):
+    Returns:
+        httpx.AsyncClient с пулом соединений и заголовками JSON.
+    """
+
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            timeout=httpx.Timeout(TIMEOUT[1], connect=TIMEOUT[0]),
+            headers=JSON_HEADERS,
+        )
+    return _CLIENT
+
+
+async def close_client():
+    """Закрывает общий клиент httpx, если он был открыт."""
+
+    if _CLIENT is not None and not _CLIENT.is_closed:
+        await _CLIENT.aclose()
+
+
+@functools.lru_cache(maxsize=8)
+def _auth_headers(client_id, seller_token):
+    """Собирает заголовки авторизации Ozon один раз для пары id и токена.
+
+    Args:
+        client_id: id клиента для аутентификации.
+        seller_token: Токен продавца для аутентификации.
+
+    Returns:
+        Словарь заголовков. Общий для всех запросов, изменять его нельзя.
+    """
+
+    return {
+        "Client-Id": client_id,
+        "Api-Key": seller_token,
+    }
+
+
+def retry_async(attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF):
+    """Повторяет корутину при временных ошибках API.
+
+    Задержка между попытками растет экспоненциально: backoff * 2 ** попытка,
+    либо берется из заголовка Retry-After, если API его вернул, но не больше
+    backoff * 2 ** attempts.
+
+    Args:
+        attempts: Максимальное количество попыток.
+        backoff: Базовая задержка в секундах.
+
+    Raises:
+        httpx.HTTPError: Если все попытки завершились ошибкой.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(attempts):
+                try:
+                    return await func(*args, **kwargs)
+                except httpx.HTTPStatusError as error:
+                    status = error.response.status_code
+                    if status not in RETRY_STATUSES or attempt == attempts - 1:
+                        raise
+                    retry_after = error.response.headers.get("Retry-After", "")
+                    if retry_after.isdigit():
+                        # Не ждем дольше самой большой задержки backoff, иначе
+                        # загрузка надолго держит место в общем семафоре:
+                        await asyncio.sleep(
+                            min(int(retry_after), backoff * 2**attempts)
+                        )
+                        continue
+                except httpx.TransportError:
+                    if attempt == attempts - 1:
+                        raise
+                await asyncio.sleep(backoff * 2**attempt)
+
+        return wrapper
+
+    return decorator
+
+
+class Product(msgspec.Struct):
+    """Товар из ответа /v2/product/list, нужен только артикул."""
+
+    offer_id: str
+
+
+class ProductList(msgspec.Struct):
+    """Страница списка товаров Ozon."""
+
+    items: list[Product]
+    total: int
+    last_id: str = ""
+
+
+class ProductListResponse(msgspec.Struct):
+    """Ответ API /v2/product/list."""
+
+    result: ProductList
+
+
+_PRODUCT_LIST_DECODER = msgspec.json.Decoder(ProductListResponse)
+
+
+@retry_async()
+async def get_product_list(last_id, client_id, seller_token):
     """Отправляет запрос api Ozon и получает список товаров на сайте Ozon..
 
     Args:
@@ -20,17 +177,16 @@ def get_product_list(last_id, client_id, seller_token):
         seller_token: Токен продавца для аутентификации.
 
     Returns:
-        Вернет результат JSON-ответа в виде словаря, содержащего список товаров.
+        Вернет страницу товаров ProductList. Поля ответа, которые не
+        используются, при разборе JSON пропускаются.
 
     Raises:
-        requests.exceptions.RequestException:
+        httpx.HTTPStatusError:
+        msgspec.ValidationError: Если ответ не совпадает с ожидаемой схемой.
     """
 
     url = "https://api-seller.ozon.ru/v2/product/list"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
+    headers = _auth_headers(client_id, seller_token)
     payload = {
         "filter": {
             "visibility": "ALL",
@@ -38,13 +194,15 @@ def get_product_list(last_id, client_id, seller_token):
         "last_id": last_id,
         "limit": 1000,
     }
-    response = requests.post(url, json=payload, headers=headers)
+    async with _SEMAPHORE:
+        response = await get_client().post(
+            url, content=orjson.dumps(payload), headers=headers
+        )
     response.raise_for_status()
-    response_object = response.json()
-    return response_object.get("result")
+    return _PRODUCT_LIST_DECODER.decode(response.content).result
 
 
-def get_offer_ids(client_id, seller_token):
+async def get_offer_ids(client_id, seller_token):
     """Получает артикулы товаров на сайте Ozon.
 
     Args:
@@ -55,25 +213,31 @@ def get_offer_ids(client_id, seller_token):
         Возвращает cписок артикулов товаров.
 
     Raises:
-        requests.exceptions.RequestException:
+        httpx.HTTPStatusError:
     """
 
-    last_id = ""
     product_list = []
-    while True:
-        some_prod = get_product_list(last_id, client_id, seller_token)
-        product_list.extend(some_prod.get("items"))
-        total = some_prod.get("total")
-        last_id = some_prod.get("last_id")
-        if total == len(product_list):
-            break
+    next_page = asyncio.create_task(get_product_list("", client_id, seller_token))
+    while next_page:
+        some_prod = await next_page
+        items = some_prod.items
+        total = some_prod.total
+        last_id = some_prod.last_id
+        # Следующая страница грузится, пока разбираем текущую:
+        next_page = None
+        if items and len(product_list) + len(items) < total:
+            next_page = asyncio.create_task(
+                get_product_list(last_id, client_id, seller_token)
+            )
+        product_list.extend(items)
     offer_ids = []
     for product in product_list:
-        offer_ids.append(product.get("offer_id"))
+        offer_ids.append(product.offer_id)
     return offer_ids
 
 
-def update_price(prices: list, client_id, seller_token):
+@retry_async()
+async def update_price(prices: list, client_id, seller_token):
     """Обновляет цены товаров на сайте Ozon.
 
     Args:
@@ -85,21 +249,21 @@ def update_price(prices: list, client_id, seller_token):
         Возвращяет результат в виде словаря.
 
     Raises:
-        requests.exceptions.RequestException:
+        httpx.HTTPStatusError:
     """
 
     url = "https://api-seller.ozon.ru/v1/product/import/prices"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
+    headers = _auth_headers(client_id, seller_token)
     payload = {"prices": prices}
-    response = requests.post(url, json=payload, headers=headers)
+    response = await get_client().post(
+        url, content=orjson.dumps(payload), headers=headers
+    )
     response.raise_for_status()
-    return response.json()
+    return orjson.loads(response.content)
 
 
-def update_stocks(stocks: list, client_id, seller_token):
+@retry_async()
+async def update_stocks(stocks: list, client_id, seller_token):
     """Обновляет остатки товаров на сайте Ozon.
 
     Args:
@@ -111,46 +275,146 @@ def update_stocks(stocks: list, client_id, seller_token):
         Возвращает результат в виде словаря.
 
     Raises:
-        requests.exceptions.RequestException: Если запрос к API не удался.
+        httpx.HTTPStatusError: Если запрос к API не удался.
     """
 
     url = "https://api-seller.ozon.ru/v1/product/import/stocks"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
+    headers = _auth_headers(client_id, seller_token)
     payload = {"stocks": stocks}
-    response = requests.post(url, json=payload, headers=headers)
+    response = await get_client().post(
+        url, content=orjson.dumps(payload), headers=headers
+    )
     response.raise_for_status()
-    return response.json()
+    return orjson.loads(response.content)
+
+
+def _download_archive(url, headers):
+    """Скачивает архив с остатками в память.
+
+    Args:
+        url: Адрес архива.
+        headers: Дополнительные заголовки, например для условного запроса.
+
+    Returns:
+        Архив в io.BytesIO и словарь с ETag и Last-Modified ответа.
+        Если сервер ответил 304, вместо архива возвращается None.
+
+    Raises:
+        requests.exceptions.RequestException:
+    """
+
+    archive_file = io.BytesIO()
+    with _SESSION.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        response.raise_for_status()
+        if response.status_code == 304:
+            return None, {}
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            archive_file.write(chunk)
+        meta = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+    return archive_file, meta
+
+
+def _cache_headers(cache_file, meta_file):
+    """Собирает заголовки условного запроса по сохраненным метаданным кэша.
+
+    Returns:
+        Словарь заголовков. Пустой, если кэша нет или его не удалось прочитать.
+    """
+
+    if not cache_file.exists():
+        return {}
+    try:
+        meta = orjson.loads(meta_file.read_bytes())
+    except (OSError, ValueError):
+        return {}
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+def _replace_file(path, write):
+    """Записывает файл через временный файл и os.replace.
+
+    Другие процессы видят либо старый файл, либо новый целиком,
+    но никогда недописанный.
+
+    Args:
+        path: Путь к итоговому файлу.
+        write: Функция, записывающая данные по переданному пути.
+    """
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
 
 
 def download_stock():
     """Скачивает файл с остатками товаров с сайта Casio.
 
+    Разобранная таблица сохраняется в CACHE_DIR вместе с ETag и Last-Modified
+    ответа. Если файл на сайте не изменился, сервер ответит 304 и таблица
+    будет прочитана из кэша без повторной загрузки и разбора .xls.
+    Ошибки чтения и записи кэша не прерывают загрузку остатков.
+
     Returns:
-        Возвращает список остатков товаров в виде словаря.
+        Возвращает таблицу остатков товаров (pandas.DataFrame),
+        артикулы в столбце "Код" приведены к строке.
 
     Raises:
         requests.exceptions.RequestException:
-        FileNotFoundError:
+        FileNotFoundError: Если в архиве нет файла .xls.
     """
 
     casio_url = "https://timeworld.ru/upload/files/ostatki.zip"
-    session = requests.Session()
-    response = session.get(casio_url)
-    response.raise_for_status()
-    with response, zipfile.ZipFile(io.BytesIO(response.content)) as archive:
-        archive.extractall(".")
-    # Создаем список остатков часов:
-    excel_file = "ostatki.xls"
-    watch_remnants = pd.read_excel(
-        io=excel_file,
-        na_values=None,
-        keep_default_na=False,
-        header=17,
-    ).to_dict(orient="records")
-    os.remove("./ostatki.xls")  # Удалить файл
+    cache_file = CACHE_DIR / "ostatki.pkl"
+    meta_file = CACHE_DIR / "ostatki.meta"
+    archive_file, meta = _download_archive(
+        casio_url, _cache_headers(cache_file, meta_file)
+    )
+    if archive_file is None:
+        try:
+            return pd.read_pickle(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError) as error:
+            logger.warning("Не удалось прочитать кэш остатков: %s", error)
+            try:
+                meta_file.unlink(missing_ok=True)
+            except OSError:
+                pass
+            archive_file, meta = _download_archive(casio_url, {})
+    # Создаем список остатков часов прямо из архива, не распаковывая его на диск:
+    with zipfile.ZipFile(archive_file) as archive:
+        excel_files = [name for name in archive.namelist() if name.endswith(".xls")]
+        if not excel_files:
+            raise FileNotFoundError("В архиве с остатками нет файла .xls")
+        with archive.open(excel_files[0]) as excel:
+            watch_remnants = pd.read_excel(
+                io=excel,
+                na_values=None,
+                keep_default_na=False,
+                header=17,
+                engine="calamine",
+            )
+    # Артикулы сравниваются со строками из API, приводим их к строке один раз:
+    watch_remnants["Код"] = watch_remnants["Код"].astype(str)
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _replace_file(cache_file, watch_remnants.to_pickle)
+        _replace_file(
+            meta_file, lambda path: Path(path).write_bytes(orjson.dumps(meta))
+        )
+    except OSError as error:
+        logger.warning("Не удалось сохранить кэш остатков: %s", error)
     return watch_remnants
 
 
@@ -158,8 +422,8 @@ def create_stocks(watch_remnants, offer_ids):
     """Создает список остатков товаров для обновления.
 
     Args:
-        watch_remnants: Список остатков товаров.
-        offer_ids: Список артикулов товаров.
+        watch_remnants: Таблица остатков товаров.
+        offer_ids: Множество артикулов товаров.
 
     Returns:
         Возвращает список остатков товаров для обновления.
@@ -168,30 +432,27 @@ def create_stocks(watch_remnants, offer_ids):
         ValueError: Если артикул товара не найден.
     """
 
-    stocks = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append({"offer_id": str(watch.get("Код")), "stock": stock})
-            offer_ids.remove(str(watch.get("Код")))
+    remaining = set(offer_ids)
+    codes = watch_remnants["Код"]
+    matched = codes.isin(remaining) & ~codes.duplicated()
+    matched_codes = codes[matched]
+    counts = stock_conversion(watch_remnants.loc[matched, "Количество"]).tolist()
+    remaining.difference_update(matched_codes)
+    matched_stocks = [
+        {"offer_id": offer_id, "stock": count}
+        for offer_id, count in zip(matched_codes, counts)
+    ]
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
-        stocks.append({"offer_id": offer_id, "stock": 0})
-    return stocks
+    missing_stocks = [{"offer_id": offer_id, "stock": 0} for offer_id in remaining]
+    return matched_stocks + missing_stocks
 
 
 def create_prices(watch_remnants, offer_ids):
     """Создает список цен товаров для обновления.
 
     Args:
-        watch_remnants: Список остатков товаров.
-        offer_ids: Список артикулов товаров.
+        watch_remnants: Таблица остатков товаров.
+        offer_ids: Множество артикулов товаров.
 
     Returns:
         Возвращает список цен товаров для обновления.
@@ -200,17 +461,19 @@ def create_prices(watch_remnants, offer_ids):
         ValueError: Если артикул товара не найден.
     """
 
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "auto_action_enabled": "UNKNOWN",
-                "currency_code": "RUB",
-                "offer_id": str(watch.get("Код")),
-                "old_price": "0",
-                "price": price_conversion(watch.get("Цена")),
-            }
-            prices.append(price)
+    codes = watch_remnants["Код"]
+    matched = codes.isin(offer_ids)
+    values = price_series_conversion(watch_remnants.loc[matched, "Цена"])
+    prices = [
+        {
+            "auto_action_enabled": "UNKNOWN",
+            "currency_code": "RUB",
+            "offer_id": offer_id,
+            "old_price": "0",
+            "price": price,
+        }
+        for offer_id, price in zip(codes[matched], values.tolist())
+    ]
     return prices
 
 
@@ -230,12 +493,49 @@ def price_conversion(price: str) -> str:
         requests.exceptions.RequestException:
     """
 
-    return re.sub("[^0-9]", "", price.split(".")[0])
+    return _NONDIGIT.sub("", price.split(".", 1)[0])
+
+
+def price_series_conversion(prices: pd.Series) -> pd.Series:
+    """Преобразует столбец цен так же, как price_conversion, но сразу целиком.
+
+    Args:
+        prices (pd.Series): Столбец строк с ценами.
+
+    Returns:
+        pd.Series: Строки, содержащие только цифры до точки.
+    """
+
+    return (
+        prices.astype(str)
+        .str.split(".", n=1)
+        .str[0]
+        .str.replace(_NONDIGIT, "", regex=True)
+    )
+
+
+def stock_conversion(counts: pd.Series) -> np.ndarray:
+    """Преобразует столбец количества товара в остатки для загрузки.
+
+    ">10" превращается в 100, "1" в 0, остальные значения в число.
+
+    Args:
+        counts (pd.Series): Столбец "Количество" из таблицы остатков.
+
+    Returns:
+        np.ndarray: Массив целых остатков.
+    """
+
+    counts = counts.astype(str)
+    numeric = pd.to_numeric(counts, errors="coerce").fillna(0).astype(int)
+    return np.where(counts == ">10", 100, np.where(counts == "1", 0, numeric))
 
 
 def divide(lst: list, n: int):
     """Разделяет список на части по n элементов.
 
+    Принимает любой итерируемый объект, части берутся из него по очереди.
+
     Args:
         lst: Список, который необходимо разделить.
         n: Количество элементов в каждой части.
@@ -244,57 +544,99 @@ def divide(lst: list, n: int):
         Возвращает разделенный список [[1, 2], [3, 4], [5, 6]]
     """
 
-    for i in range(0, len(lst), n):
-        yield lst[i : i + n]
+    iterator = iter(lst)
+    while chunk := list(islice(iterator, n)):
+        yield chunk
+
 
+async def upload_in_chunks(update, items: list, n: int, *args, semaphore=None):
+    """Параллельно загружает список частями по n элементов.
 
-async def upload_prices(watch_remnants, client_id, seller_token):
+    Одновременно выполняется не больше UPLOAD_CONCURRENCY запросов,
+    если не передан общий semaphore.
+
+    Args:
+        update: Корутина, загружающая одну часть, например update_stocks.
+        items: Список, который необходимо загрузить.
+        n: Количество элементов в каждой части.
+        *args: Остальные аргументы для update.
+        semaphore: asyncio.Semaphore, общий для нескольких загрузок в один API.
+
+    Returns:
+        Список ответов API по каждой части.
+
+    Raises:
+        httpx.HTTPError: Первая из ошибок, если часть загрузок не удалась.
+    """
+
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    async def bounded(chunk):
+        async with semaphore:
+            return await update(chunk, *args)
+
+    tasks = [asyncio.create_task(bounded(chunk)) for chunk in divide(items, n)]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    for error in errors:
+        logger.error("Не удалось загрузить часть данных: %s", error)
+    if errors:
+        raise errors[0]
+    return results
+
+
+async def upload_prices(watch_remnants, client_id, seller_token, offer_ids=None):
     """Получает список артикулов товаров и обновляет цены на сайте Ozon.
 
     Args:
-        watch_remnants: Список остатков товаров.
+        watch_remnants: Таблица остатков товаров.
         client_id: id клиента для аутентификации.
         seller_token: Токен продавца для аутентификации.
+        offer_ids: Уже полученные артикулы товаров. Если не переданы,
+            будут запрошены через get_offer_ids.
 
     Returns:
         Возвращает список обновленных цен товаров.
 
     Raises:
-       requests.exceptions.RequestException:
+       httpx.HTTPError:
     """
 
-    offer_ids = get_offer_ids(client_id, seller_token)
+    if offer_ids is None:
+        offer_ids = set(await get_offer_ids(client_id, seller_token))
     prices = create_prices(watch_remnants, offer_ids)
-    for some_price in list(divide(prices, 1000)):
-        update_price(some_price, client_id, seller_token)
+    await upload_in_chunks(update_price, prices, 1000, client_id, seller_token)
     return prices
 
 
-async def upload_stocks(watch_remnants, client_id, seller_token):
+async def upload_stocks(watch_remnants, client_id, seller_token, offer_ids=None):
     """Получает список артикулов товаров и обновляет их остатки на сайте Ozon.
 
     Args:
-        watch_remnants: Список остатков товаров.
+        watch_remnants: Таблица остатков товаров.
         client_id: id клиента для аутентификации.
         seller_token: Токен продавца для аутентификации.
+        offer_ids: Уже полученные артикулы товаров. Если не переданы,
+            будут запрошены через get_offer_ids.
 
     Returns:
         not_empty: Список товаров с ненулевыми остатками.
         stocks: Список всех товаров с остатками.
 
     Raises:
-        requests.exceptions.RequestException:
+        httpx.HTTPError:
     """
 
-    offer_ids = get_offer_ids(client_id, seller_token)
+    if offer_ids is None:
+        offer_ids = set(await get_offer_ids(client_id, seller_token))
     stocks = create_stocks(watch_remnants, offer_ids)
-    for some_stock in list(divide(stocks, 100)):
-        update_stocks(some_stock, client_id, seller_token)
+    await upload_in_chunks(update_stocks, stocks, 100, client_id, seller_token)
     not_empty = list(filter(lambda stock: (stock.get("stock") != 0), stocks))
     return not_empty, stocks
 
 
-def main():
+async def main():
     """Основная функция для обновления остатков и цен товаров.
 
    Использует переменные окружения для получения токена продавца и идентификатора клиента.
@@ -307,23 +649,32 @@ def main():
     seller_token = env.str("SELLER_TOKEN")
     client_id = env.str("CLIENT_ID")
     try:
-        offer_ids = get_offer_ids(client_id, seller_token)
-        watch_remnants = download_stock()
-        # Обновить остатки
+        offer_ids, watch_remnants = await asyncio.gather(
+            get_offer_ids(client_id, seller_token),
+            asyncio.to_thread(download_stock),
+        )
+        offer_ids = set(offer_ids)
         stocks = create_stocks(watch_remnants, offer_ids)
-        for some_stock in list(divide(stocks, 100)):
-            update_stocks(some_stock, client_id, seller_token)
-        # Поменять цены
         prices = create_prices(watch_remnants, offer_ids)
-        for some_price in list(divide(prices, 900)):
-            update_price(some_price, client_id, seller_token)
-    except requests.exceptions.ReadTimeout:
+        # Обновить остатки и поменять цены. Клиент закрывается только
+        # после завершения обеих загрузок, даже если одна из них упала:
+        results = await asyncio.gather(
+            upload_in_chunks(update_stocks, stocks, 100, client_id, seller_token),
+            upload_in_chunks(update_price, prices, 900, client_id, seller_token),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+    except (requests.exceptions.ReadTimeout, httpx.TimeoutException):
         print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
+    except (requests.exceptions.ConnectionError, httpx.NetworkError) as error:
         print(error, "Ошибка соединения")
     except Exception as error:
         print(error, "ERROR_2")
+    finally:
+        await close_client()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())